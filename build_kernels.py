@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+import os
+from numba.pycc import CC
+import silence_kernels
+
+# Ahead-of-time compile the silence kernels into the _silence_aot extension
+# module next to this script. silence_kernels imports it when present, so CLI
+# runs skip importing numba and JIT-compiling the kernels on every start. Run
+# it again after changing any of the *_loop kernels.
+
+
+def build(output_dir=None):
+    cc = CC("_silence_aot")
+    cc.output_dir = output_dir or os.path.dirname(os.path.abspath(__file__))
+    # Any-layout arrays, so strided frame views work as they do under the JIT
+    for suffix in silence_kernels.AOT_SAMPLE_TYPES.values():
+        cc.export(f"window_mean_square_{suffix}", f"f8[:]({suffix}[:,:], i8)")(silence_kernels._window_mean_square_loop)
+        cc.export(f"ms_energy_{suffix}", f"f8[:]({suffix}[:,:], i8[:])")(silence_kernels._ms_energy_loop)
+    cc.export("silent_ranges", "i8[:,:](f8[:], i8[:], i8, i8, i8, f8)")(silence_kernels._silent_ranges_loop)
+
+    # Stamp the build with the kernels' source hash; silence_kernels falls back
+    # to the JIT when it no longer matches
+    version = silence_kernels.kernels_version()
+
+    def kernels_version():
+        return version
+    cc.export("kernels_version", "i8()")(kernels_version)
+    cc.compile()
+    return cc.output_dir
+
+
+if __name__ == "__main__":
+    print(f"Built _silence_aot in {build()}")
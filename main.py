@@ -1,33 +1,54 @@
 import os
 import argparse
-import tempfile
-import shutil
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 
-from pydub import AudioSegment, silence
 from utils import (
     analyze_audio,
     plot_waveform,
     plot_dbfs,
     recommend_silence_threshold,
-    convert_to_pcm,
-    export_to_mp3
+    detect_nonsilent_np,
+    detect_nonsilent_ffmpeg,
+    open_audio,
+    export_wav,
+    export_wav_ranges,
+    export_mp3,
+    pad_ranges,
+    positive_int,
+    decode_to_segment
 )
 from musicAnalyzer import MusicAnalyzer
 
-def process_file(filepath, output_dir, mode, silence_thresh, min_silence_len, keep_silence, plot, dbfs_plot, convert, auto, mp3_out, song_detector=False):
+
+def _export_segment(audio, start_ms, end_ms, out_path, mp3_out, keep_wav):
+    # Thread pool worker: writes straight from a view of the decoded audio. File
+    # writes and the ffmpeg encoder release the GIL, so segments overlap without
+    # pickling their PCM over to worker processes.
+    t0 = time.time()
+    if keep_wav or not mp3_out:
+        export_wav(audio, out_path, start_ms, end_ms)
+    if mp3_out:
+        export_mp3(audio, os.path.splitext(out_path)[0] + ".mp3", [(start_ms, end_ms)])
+    return time.time() - t0
+
+
+def process_file(filepath, output_dir, mode, silence_thresh, min_silence_len, keep_silence, plot, dbfs_plot, convert, auto, mp3_out, song_detector=False, keep_wav=False, audio=None, silence_backend="python", pcm_cache=False, seek_step=1):
     logging.info(f"Processing file: {filepath}")
     
     original_ext = os.path.splitext(filepath)[1].lower()
-    converted_to_wav = False
+    converted_to_wav = original_ext != '.wav' or convert
     
-    if original_ext != '.wav' or convert:
-        logging.info("Converting to PCM WAV for better performance...")
-        filepath = convert_to_pcm(filepath, output_dir)
-        converted_to_wav = True
+    # A caller that already decoded the file (e.g. the benchmark) can pass it in
+    if audio is None:
+        if convert:
+            logging.info("Converting to 16-bit 44.1 kHz stereo PCM...")
+            audio = decode_to_segment(filepath)
+        else:
+            audio = open_audio(filepath, pcm_cache)
 
-    audio = AudioSegment.from_file(filepath)
     duration = len(audio) / 1000
     size = os.path.getsize(filepath) / (1024 * 1024)
     logging.info(f"Duration: {duration:.2f} seconds")
@@ -49,66 +70,65 @@ def process_file(filepath, output_dir, mode, silence_thresh, min_silence_len, ke
                 silence_thresh = float(user_input.strip())
 
     logging.info(f"Detecting silence to {mode} audio...")
-    segments = silence.detect_nonsilent(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh, seek_step=1)
+    if silence_backend == "ffmpeg":
+        segments = detect_nonsilent_ffmpeg(filepath, len(audio), min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    else:
+        segments = detect_nonsilent_np(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh, seek_step=seek_step)
     logging.info(f"Detected {len(segments)} segments")
 
     if not segments:
         logging.warning("No non-silent segments found. Skipping file.")
         return
 
+    if keep_silence:
+        segments = pad_ranges(segments, keep_silence, len(audio))
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     if mode == "split":
-        for i, (start, end) in enumerate(segments):
-            segment = audio[start:end]
-            out_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(filepath))[0]}_segment_{i+1}.wav")
-            t0 = time.time()
-            segment.export(out_path, format="wav")
-            t1 = time.time()
-            logging.info(f"Exported: {out_path} | Duration: {(end - start)/1000:.2f}s | Time Taken: {t1 - t0:.2f}s")
-            if mp3_out:
-                export_to_mp3(out_path)
+        base_name = os.path.splitext(os.path.basename(filepath))[0]
+        out_paths = [os.path.join(output_dir, f"{base_name}_segment_{i+1}.wav") for i in range(len(segments))]
+        starts, ends = zip(*segments)
+
+        # MP3 encoding is CPU-bound (one single-threaded encoder per segment), so
+        # it gets a worker per core; plain WAV writes are I/O-bound
+        workers = os.cpu_count() or 1
+        if not mp3_out:
+            workers = min(8, workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            timings = executor.map(_export_segment, repeat(audio), starts, ends, out_paths, repeat(mp3_out), repeat(keep_wav))
+            for (start, end), out_path, elapsed in zip(segments, out_paths, timings):
+                if mp3_out and not keep_wav:
+                    out_path = os.path.splitext(out_path)[0] + ".mp3"
+                logging.info(f"Exported: {out_path} | Duration: {(end - start)/1000:.2f}s | Time Taken: {elapsed:.2f}s")
     elif mode == "trim":
-        # Use split approach for faster processing
-        temp_files = []
-        for i, (start, end) in enumerate(segments):
-            segment = audio[start:end]
-            temp_path = os.path.join(output_dir, f"temp_segment_{i}.wav")
-            segment.export(temp_path, format="wav")
-            temp_files.append(temp_path)
-        
-        # Stitch all parts together
-        combined = AudioSegment.empty()
-        for temp_file in temp_files:
-            combined += AudioSegment.from_wav(temp_file)
-        
         filename = os.path.basename(filepath).rsplit('.', 1)[0] + "_trimmed.wav"
         out_path = os.path.join(output_dir, filename)
-        combined.export(out_path, format="wav")
-        logging.info(f"Exported trimmed file: {out_path}")
-        
-        # Clean up temporary files
-        for temp_file in temp_files:
-            os.remove(temp_file)
+        if keep_wav or not mp3_out:
+            export_wav_ranges(audio, out_path, segments)
+            logging.info(f"Exported trimmed file: {out_path}")
         
         if mp3_out:
-            export_to_mp3(out_path)
+            mp3_path = export_mp3(audio, os.path.splitext(out_path)[0] + ".mp3", segments)
+            logging.info(f"Exported trimmed file: {mp3_path}")
     
-    # Ask user about output format if we converted to WAV
-    if converted_to_wav and not auto:
+    # Ask user about output format if we converted to WAV (--mp3_out already chose MP3)
+    if converted_to_wav and not auto and not mp3_out:
         choice = input(f"Keep WAV output or convert to original format ({original_ext})? [w=WAV / o=original]: ").lower()
         if choice == 'o':
+            # Encode from the decoded audio still in memory rather than reading
+            # the WAVs just written back off disk
             if mode == "split":
-                wav_files = [f for f in os.listdir(output_dir) if f.endswith('.wav') and 'segment' in f]
-                for wav_file in wav_files:
-                    wav_path = os.path.join(output_dir, wav_file)
-                    if original_ext == '.mp3':
-                        export_to_mp3(wav_path)
+                if original_ext == '.mp3':
+                    mp3_paths = [os.path.splitext(wav_path)[0] + ".mp3" for wav_path in out_paths]
+                    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                        list(executor.map(export_mp3, repeat(audio), mp3_paths, [[segment] for segment in segments]))
+                    for wav_path in out_paths:
                         os.remove(wav_path)
             elif mode == "trim":
                 if original_ext == '.mp3':
-                    export_to_mp3(out_path)
+                    export_mp3(audio, os.path.splitext(out_path)[0] + ".mp3", segments)
                     os.remove(out_path)
     
     # Song detection if requested
@@ -117,21 +137,17 @@ def process_file(filepath, output_dir, mode, silence_thresh, min_silence_len, ke
         analyzer = MusicAnalyzer()
         if mode == "split" and segments:
             # Analyze each segment
-            song_results = analyzer.analyze_with_silence_detection(filepath, segments, output_dir)
+            song_results = analyzer.analyze_with_silence_detection(filepath, segments, output_dir, audio=audio)
             csv_path = os.path.join(output_dir, "song_detection_segments.csv")
         else:
             # Analyze entire file
-            song_results = analyzer.analyze_audio_file(filepath, output_dir)
+            song_results = analyzer.analyze_audio_file(filepath, output_dir, audio=audio, silence_thresh=silence_thresh, min_silence_len=min_silence_len, seek_step=seek_step)
             csv_path = os.path.join(output_dir, "song_detection_timeline.csv")
         
         if song_results:
             analyzer.save_results_csv(song_results, csv_path)
             detected = sum(1 for r in song_results if r['song'] != 'undetected')
             logging.info(f"Song detection: {detected}/{len(song_results)} detected")
-    
-    # Clean up temporary WAV file
-    if converted_to_wav and '_temp.wav' in filepath:
-        os.remove(filepath)
 
 
 def main():
@@ -141,13 +157,17 @@ def main():
     parser.add_argument("--output", help="Output directory")
     parser.add_argument("--silence_thresh", type=float, help="Silence threshold (dBFS)")
     parser.add_argument("--min_silence_len", type=int, default=1000, help="Minimum silence length (ms)")
-    parser.add_argument("--keep_silence", type=int, default=200, help="Silence padding to keep (ms)")
+    parser.add_argument("--seek_step", type=positive_int, default=1, help="Silence scan step (ms); larger is coarser")
+    parser.add_argument("--keep_silence", type=int, default=0, help="Original audio kept around each segment (ms)")
     parser.add_argument("--plot", action="store_true", help="Plot waveform")
     parser.add_argument("--dbfs_plot", action="store_true", help="Plot dBFS profile")
     parser.add_argument("--convert", action="store_true", help="Convert input to WAV/PCM before processing")
     parser.add_argument("--auto", action="store_true", help="Auto accept recommended threshold")
     parser.add_argument("--mp3_out", action="store_true", help="Convert final output to MP3")
+    parser.add_argument("--keep_wav", action="store_true", help="Also keep WAV output when using --mp3_out")
     parser.add_argument("--songDetector", action="store_true", help="Detect songs and output CSV")
+    parser.add_argument("--pcm_cache", action="store_true", help="Keep decoded PCM of non-WAV input in ~/.cache/rehearsal_processor for faster re-runs")
+    parser.add_argument("--silence_backend", choices=["python", "ffmpeg"], default="python", help="Silence detection: windowed RMS like pydub (python) or ffmpeg's silencedetect filter")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
@@ -171,7 +191,11 @@ def main():
         convert=args.convert,
         auto=args.auto,
         mp3_out=args.mp3_out,
-        song_detector=args.songDetector
+        song_detector=args.songDetector,
+        keep_wav=args.keep_wav,
+        silence_backend=args.silence_backend,
+        pcm_cache=args.pcm_cache,
+        seek_step=args.seek_step
     )
     total = time.time() - start_time
     logging.info(f"Finished processing {args.input} in {total:.2f} seconds")
@@ -1,10 +1,17 @@
 import os
+import io
 import csv
 import logging
 import requests
 import hashlib
-from pydub import AudioSegment
-from utils import convert_to_pcm
+import shelve
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from operator import itemgetter
+import numpy as np
+from utils import PCM_CACHE_DIR, open_audio, export_wav, pcm_frames, recommend_silence_threshold, detect_nonsilent_np, segment_view
 
 try:
     import acoustid
@@ -26,40 +33,69 @@ except ImportError:
     SHAZAM_AVAILABLE = False
 
 
+def _normalized(vectors):
+    # Centre and scale the last axis so Pearson correlation becomes a plain dot
+    # product; constant vectors come out as NaN, like np.corrcoef
+    centered = vectors - vectors.mean(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return centered / np.linalg.norm(centered, axis=-1, keepdims=True)
+
+
+# Shazam/AcoustID results live next to the decoded-PCM cache rather than in
+# whatever directory the tools are run from
+SONG_CACHE_PATH = os.path.join(PCM_CACHE_DIR, "songcache")
+
+
 class MusicAnalyzer:
-    def __init__(self, api_key=None, reference_folder=None):
+    def __init__(self, api_key=None, reference_folder=None, cache_path=SONG_CACHE_PATH):
         self.api_key = api_key or "8XaBELgH"  # Free AcoustID key
         self.confidence_threshold = 0.5  # Even lower for covers
         self.reference_folder = reference_folder
+        self.cache_path = cache_path  # Shazam/AcoustID results by audio hash; None disables
+        self.cache_lock = None  # Set when several processes share the cache file
         self.reference_signatures = {}
+        self.ref_names = []
         if reference_folder:
             self._build_reference_database()
         
-    def analyze_audio_file(self, filepath, output_dir=None, window_size=30):
+    def analyze_audio_file(self, filepath, output_dir=None, window_size=30, audio=None, silence_thresh=None, min_silence_len=1000, seek_step=1):
         """Analyze audio file for song detection with timestamps"""
         logging.info(f"Analyzing audio file: {filepath}")
         
-        # Convert to WAV if needed
-        if not filepath.lower().endswith('.wav'):
-            filepath = convert_to_pcm(filepath, output_dir)
-            
-        # Load audio
-        audio = AudioSegment.from_wav(filepath)
+        if audio is None:
+            audio = open_audio(filepath)
         duration_ms = len(audio)
         
         results = []
         
-        # Analyze in windows
-        for start_ms in range(0, duration_ms, window_size * 1000):
-            end_ms = min(start_ms + window_size * 1000, duration_ms)
-            segment = audio[start_ms:end_ms]
-            
-            # Skip if segment too short
-            if len(segment) < 10000:  # 10 seconds minimum
+        # Analyze in windows, skipping any shorter than 10 seconds
+        windows = [
+            (start_ms, min(start_ms + window_size * 1000, duration_ms))
+            for start_ms in range(0, duration_ms, window_size * 1000)
+        ]
+        windows = [(start_ms, end_ms) for start_ms, end_ms in windows if end_ms - start_ms >= 10000]
+        
+        # Silent windows (breaks between takes) skip detection and its network calls
+        audible = self._audible_windows(audio, windows, silence_thresh, min_silence_len, seek_step)
+        
+        # Shazam lookups are network-bound, so they all run concurrently up front
+        audible_windows = [window for window, is_audible in zip(windows, audible) if is_audible]
+        shazam = iter(self._shazam_detect_ranges(audio, audible_windows) if SHAZAM_AVAILABLE else [])
+        
+        for (start_ms, end_ms), is_audible in zip(windows, audible):
+            timestamp = self._ms_to_timestamp(start_ms)
+            if not is_audible:
+                results.append({
+                    'timestamp': timestamp,
+                    'song': 'undetected',
+                    'artist': '',
+                    'confidence': 0.0,
+                    'method': 'silence'
+                })
                 continue
                 
-            timestamp = self._ms_to_timestamp(start_ms)
-            detections = self._detect_song_segment(segment)
+            segment = segment_view(audio, start_ms, end_ms)
+            detections = self._detect_song_segment(segment, next(shazam, None))
             
             if detections:
                 for detection in detections:
@@ -81,13 +117,25 @@ class MusicAnalyzer:
                 
         return results
     
-    def _detect_song_segment(self, segment):
-        """Detect song using multiple methods"""
+    def _audible_windows(self, audio, windows, silence_thresh=None, min_silence_len=1000, seek_step=1):
+        """Whether each (start_ms, end_ms) window has any sound above the silence threshold"""
+        if silence_thresh is None:
+            silence_thresh = recommend_silence_threshold(audio)
+        nonsilent = np.array(detect_nonsilent_np(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh, seek_step=seek_step), dtype=np.int64).reshape(-1, 2)
+        bounds = np.array(windows, dtype=np.int64).reshape(-1, 2)
+        # The first non-silent range ending after a window starts overlaps it
+        # exactly when it also begins before the window ends
+        first = np.searchsorted(nonsilent[:, 1], bounds[:, 0], side='right')
+        first_start = np.append(nonsilent[:, 0], np.iinfo(np.int64).max)[first]
+        return (first_start < bounds[:, 1]).tolist()
+    
+    def _detect_song_segment(self, segment, shazam=None):
+        """Detect song using multiple methods; shazam holds detections already looked up"""
         detections = []
         
         # Method 1: Shazam API (best for actual songs)
         if SHAZAM_AVAILABLE:
-            detections.extend(self._shazam_detect(segment))
+            detections.extend(self._shazam_detect(segment) if shazam is None else shazam)
             
         # Method 2: AcoustID (if available)
         if not detections and ACOUSTID_AVAILABLE:
@@ -103,31 +151,80 @@ class MusicAnalyzer:
             
         return detections
     
+    def _cache_key(self, method, segment):
+        """Key for a segment's detections: the method plus a hash of its audio"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{segment.frame_rate}:{segment.sample_width}:{segment.channels}".encode())
+        digest.update(segment.raw_data)
+        return f"{method}:{digest.hexdigest()}"
+    
+    def _cache_get(self, key):
+        """Cached detections for key, or None"""
+        if not self.cache_path:
+            return None
+        try:
+            with self.cache_lock or nullcontext(), shelve.open(self.cache_path) as cache:
+                return cache.get(key)
+        except Exception as e:
+            # A locked or damaged cache is only a miss, never a failed lookup
+            logging.debug(f"Song cache unavailable: {e}")
+            return None
+    
+    def _cache_put(self, key, detections):
+        """Remember the detections of a successful lookup"""
+        # Empty results (no match, throttled or partial replies) are not
+        # stored, so those segments are looked up again on the next run
+        if not self.cache_path or not detections:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            with self.cache_lock or nullcontext(), shelve.open(self.cache_path) as cache:
+                cache[key] = detections
+        except Exception as e:
+            logging.debug(f"Song cache unavailable: {e}")
+    
     def _shazam_detect(self, segment):
         """Shazam detection using shazamio"""
+        return asyncio.run(self._async_shazam_segment(segment))
+    
+    def _shazam_detect_ranges(self, audio, ranges, max_concurrent=8):
+        """Shazam detections for each (start_ms, end_ms) range, looked up concurrently in one event loop"""
+        return asyncio.run(self._async_shazam_ranges(audio, ranges, max_concurrent))
+    
+    async def _async_shazam_ranges(self, audio, ranges, max_concurrent):
+        """Gather the lookups; the semaphore keeps within Shazam's rate limits"""
+        semaphore = asyncio.Semaphore(max_concurrent)
+        
+        async def detect(start_ms, end_ms):
+            async with semaphore:
+                return await self._async_shazam_segment(segment_view(audio, start_ms, end_ms))
+                
+        return await asyncio.gather(*(detect(start_ms, end_ms) for start_ms, end_ms in ranges))
+    
+    async def _async_shazam_segment(self, segment):
+        """Cached Shazam detection of one segment"""
         try:
-            temp_path = "temp_segment.wav"
-            segment.export(temp_path, format="wav")
-            
-            # Run async Shazam detection
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(self._async_shazam_detect(temp_path))
-            loop.close()
-            
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            key = self._cache_key("shazam", segment)
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
                 
+            # shazamio takes the WAV as bytes, so nothing touches the disk
+            buf = io.BytesIO()
+            export_wav(segment, buf)
+            result = await self._async_shazam_detect(buf.getvalue())
+                
+            self._cache_put(key, result)
             return result
             
         except Exception as e:
             logging.info(f"Shazam failed: {e}")
             return []
     
-    async def _async_shazam_detect(self, temp_path):
+    async def _async_shazam_detect(self, wav_data):
         """Async Shazam detection"""
         shazam = Shazam()
-        result = await shazam.recognize(temp_path)
+        result = await shazam.recognize(wav_data)
         
         detections = []
         if result and 'track' in result:
@@ -148,10 +245,13 @@ class MusicAnalyzer:
     def _acoustid_detect(self, segment):
         """AcoustID detection (requires fpcalc)"""
         try:
-            temp_path = "temp_segment.wav"
-            segment.export(temp_path, format="wav")
-            
-            results = acoustid.match(self.api_key, temp_path)
+            key = self._cache_key("acoustid", segment)
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
+                
+            duration, fingerprint = self._acoustid_fingerprint(segment)
+            results = acoustid.parse_lookup_result(acoustid.lookup(self.api_key, fingerprint, duration))
             detections = []
             
             for score, recording_id, title, artist in results:
@@ -162,33 +262,41 @@ class MusicAnalyzer:
                         'confidence': score,
                         'method': 'acoustid'
                     })
-            
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
                 
+            self._cache_put(key, detections)
             return detections
             
         except Exception as e:
             logging.debug(f"AcoustID failed: {e}")
             return []
     
+    def _acoustid_fingerprint(self, segment):
+        """Chromaprint (duration, fingerprint) of a segment"""
+        if acoustid.have_chromaprint and segment.sample_width == 2:
+            # The Chromaprint library takes 16-bit PCM directly: no file, no fpcalc process
+            fingerprint = acoustid.fingerprint(segment.frame_rate, segment.channels, iter([segment.raw_data]))
+            return len(segment) / 1000, fingerprint
+            
+        # fpcalc needs a file; a unique temp name keeps concurrent runs apart
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+            export_wav(segment, tmp)
+        try:
+            return acoustid.fingerprint_file(tmp.name)
+        finally:
+            os.remove(tmp.name)
+    
     def _tempo_detect(self, segment):
         """Enhanced audio analysis for covers"""
         if not LIBROSA_AVAILABLE:
             return []
             
         try:
-            temp_path = "temp_segment.wav"
-            segment.export(temp_path, format="wav")
-            
-            y, sr = librosa.load(temp_path)
+            y, sr = self._librosa_input(segment)
             
             # Extract multiple features
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-            tempo_val = float(tempo.item()) if hasattr(tempo, 'item') else float(tempo)
+            tempo_val, chroma, _ = self._spectral_features(y, sr)
             
             # Chord progression (simplified)
-            chroma = librosa.feature.chroma_stft(y=y, sr=sr)
             chroma_mean = chroma.mean(axis=1)
             dominant_notes = chroma_mean.argsort()[-3:][::-1]  # Top 3 notes
             
@@ -209,9 +317,6 @@ class MusicAnalyzer:
                     'method': 'audio_signature'
                 })
                 logging.info(f"Audio signature: {estimated_key} key, {tempo_val:.1f} BPM")
-            
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
                 
             return detections
             
@@ -219,6 +324,30 @@ class MusicAnalyzer:
             logging.debug(f"Audio analysis failed: {e}")
             return []
     
+    def _librosa_input(self, segment, sr=22050):
+        """Mono float samples at sr taken from the segment's PCM, as librosa.load would return them"""
+        scale = float(1 << (8 * segment.sample_width - 1))
+        # Channels are summed into a single float32 buffer and scaled in place,
+        # rather than converting the whole interleaved PCM to float first
+        frames = pcm_frames(segment)
+        y = frames[:, 0].astype(np.float32)
+        for c in range(1, segment.channels):
+            np.add(y, frames[:, c], out=y, dtype=np.float32)
+        y /= segment.channels * scale
+        return librosa.resample(y, orig_sr=segment.frame_rate, target_sr=sr), sr
+    
+    def _spectral_features(self, y, sr):
+        """Tempo, chroma and log-mel spectrogram of y from a single STFT"""
+        # beat_track, chroma_stft and mfcc would each compute the same 2048-point
+        # power spectrogram (and two of them the same mel spectrogram) on their own
+        power = np.abs(librosa.stft(y)) ** 2
+        mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr))
+        onset_env = librosa.onset.onset_strength(S=mel_db, sr=sr, aggregate=np.median)
+        tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+        tempo_val = float(tempo.item()) if hasattr(tempo, 'item') else float(tempo)
+        chroma = librosa.feature.chroma_stft(S=power, sr=sr)
+        return tempo_val, chroma, mel_db
+    
     def _build_reference_database(self):
         """Build signatures from reference songs"""
         if not LIBROSA_AVAILABLE or not os.path.exists(self.reference_folder):
@@ -226,45 +355,62 @@ class MusicAnalyzer:
             
         logging.info(f"Building reference database from: {self.reference_folder}")
         
-        for filename in os.listdir(self.reference_folder):
-            if filename.lower().endswith(('.mp3', '.wav', '.flac', '.m4a')):
-                filepath = os.path.join(self.reference_folder, filename)
-                try:
-                    # Load and analyze reference song
-                    audio = AudioSegment.from_file(filepath)
-                    # Take middle 30 seconds for signature
-                    mid_point = len(audio) // 2
-                    segment = audio[mid_point-15000:mid_point+15000]
+        filenames = [
+            filename for filename in os.listdir(self.reference_folder)
+            if filename.lower().endswith(('.mp3', '.wav', '.flac', '.m4a'))
+        ]
+        if not filenames:
+            return
+            
+        # Each reference is decoded and analyzed independently, so the CPU-bound
+        # work is spread over worker processes; results are taken in listing order.
+        # With a single worker, starting a process would only add overhead.
+        filepaths = [os.path.join(self.reference_folder, filename) for filename in filenames]
+        workers = min(len(filenames), os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_reference_signature, filepath) for filepath in filepaths]
+                for filename, future in zip(filenames, futures):
+                    self._add_reference(filename, future.result)
+        else:
+            for filename, filepath in zip(filenames, filepaths):
+                self._add_reference(filename, lambda: _reference_signature(filepath))
                     
-                    signature = self._extract_signature(segment)
-                    if signature:
-                        song_name = os.path.splitext(filename)[0]
-                        self.reference_signatures[song_name] = signature
-                        logging.info(f"Added reference: {song_name}")
-                        
-                except Exception as e:
-                    logging.warning(f"Failed to process reference {filename}: {e}")
+        self._stack_references()
+    
+    def _add_reference(self, filename, get_signature):
+        """Store the signature returned by get_signature under the song's name"""
+        try:
+            signature = get_signature()
+            if signature:
+                song_name = os.path.splitext(filename)[0]
+                self.reference_signatures[song_name] = signature
+                logging.info(f"Added reference: {song_name}")
+                
+        except Exception as e:
+            logging.warning(f"Failed to process reference {filename}: {e}")
+    
+    def _stack_references(self):
+        """Reference signatures as arrays, so matching scores every reference at once"""
+        signatures = list(self.reference_signatures.values())
+        self.ref_names = list(self.reference_signatures)
+        if not signatures:
+            return
+        self.ref_tempo = np.array([sig['tempo'] for sig in signatures])
+        self.ref_chroma = _normalized(np.array([sig['chroma'] for sig in signatures]))
+        self.ref_mfcc = _normalized(np.array([sig['mfcc'] for sig in signatures]))
     
     def _extract_signature(self, segment):
         """Extract audio signature for matching"""
         try:
-            temp_path = "temp_ref.wav"
-            segment.export(temp_path, format="wav")
-            
-            y, sr = librosa.load(temp_path)
+            y, sr = self._librosa_input(segment)
             
             # Extract features
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-            tempo_val = float(tempo.item()) if hasattr(tempo, 'item') else float(tempo)
-            
-            chroma = librosa.feature.chroma_stft(y=y, sr=sr)
+            tempo_val, chroma, mel_db = self._spectral_features(y, sr)
             chroma_mean = chroma.mean(axis=1)
             
-            mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=12)
+            mfcc = librosa.feature.mfcc(S=mel_db, n_mfcc=12)
             mfcc_mean = mfcc.mean(axis=1)
-            
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
                 
             return {
                 'tempo': tempo_val,
@@ -282,29 +428,27 @@ class MusicAnalyzer:
         if not current_sig:
             return []
             
-        best_match = None
-        best_score = 0
-        
-        for song_name, ref_sig in self.reference_signatures.items():
-            # Calculate similarity score
-            tempo_diff = abs(current_sig['tempo'] - ref_sig['tempo']) / max(current_sig['tempo'], ref_sig['tempo'])
-            tempo_score = max(0, 1 - tempo_diff)
+        if len(self.ref_names) != len(self.reference_signatures):
+            self._stack_references()
             
-            # Chroma similarity (chord progression)
-            import numpy as np
-            chroma_corr = np.corrcoef(current_sig['chroma'], ref_sig['chroma'])[0,1]
-            chroma_score = max(0, chroma_corr) if not np.isnan(chroma_corr) else 0
-            
-            # MFCC similarity (timbre)
-            mfcc_corr = np.corrcoef(current_sig['mfcc'], ref_sig['mfcc'])[0,1]
-            mfcc_score = max(0, mfcc_corr) if not np.isnan(mfcc_corr) else 0
-            
-            # Combined score
-            total_score = (tempo_score * 0.3 + chroma_score * 0.5 + mfcc_score * 0.2)
-            
-            if total_score > best_score and total_score > 0.6:  # Threshold for match
-                best_score = total_score
-                best_match = song_name
+        # Calculate similarity scores against all references in one go
+        tempo = current_sig['tempo']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tempo_diff = np.abs(tempo - self.ref_tempo) / np.maximum(tempo, self.ref_tempo)
+        tempo_score = np.nan_to_num(np.maximum(0, 1 - tempo_diff))
+        
+        # Chroma similarity (chord progression)
+        chroma_score = np.nan_to_num(np.maximum(0, self.ref_chroma @ _normalized(current_sig['chroma'])))
+        
+        # MFCC similarity (timbre)
+        mfcc_score = np.nan_to_num(np.maximum(0, self.ref_mfcc @ _normalized(current_sig['mfcc'])))
+        
+        # Combined score
+        total_score = tempo_score * 0.3 + chroma_score * 0.5 + mfcc_score * 0.2
+        
+        best = total_score.argmax()
+        best_score = float(total_score[best])
+        best_match = self.ref_names[best] if best_score > 0.6 else None  # Threshold for match
         
         if best_match:
             logging.info(f"Reference match: {best_match} (score: {best_score:.2f})")
@@ -324,29 +468,34 @@ class MusicAnalyzer:
     
     def _ms_to_timestamp(self, ms):
         """Convert milliseconds to MM:SS format"""
-        seconds = ms // 1000
-        minutes = seconds // 60
-        seconds = seconds % 60
+        minutes, seconds = divmod(ms // 1000, 60)
         return f"{minutes:02d}:{seconds:02d}"
     
     def save_results_csv(self, results, output_path):
         """Save detection results to CSV"""
+        # Columns come from the rows themselves, so timeline, segment and folder
+        # results can all be saved; rows are written as plain tuples rather than
+        # going through DictWriter's per-row dict checks
+        fieldnames = list(results[0]) if results else ['timestamp', 'song', 'artist', 'confidence', 'method']
         with open(output_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['timestamp', 'song', 'artist', 'confidence', 'method'])
-            writer.writeheader()
-            writer.writerows(results)
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            writer.writerows(map(itemgetter(*fieldnames), results))
         logging.info(f"Results saved to: {output_path}")
     
-    def analyze_with_silence_detection(self, filepath, segments, output_dir):
+    def analyze_with_silence_detection(self, filepath, segments, output_dir, audio=None):
         """Analyze specific segments from silence detection"""
         results = []
-        audio = AudioSegment.from_wav(filepath)
+        if audio is None:
+            audio = open_audio(filepath)
+        
+        shazam = self._shazam_detect_ranges(audio, segments) if SHAZAM_AVAILABLE else [None] * len(segments)
         
-        for i, (start_ms, end_ms) in enumerate(segments):
-            segment = audio[start_ms:end_ms]
+        for i, ((start_ms, end_ms), shazam_detections) in enumerate(zip(segments, shazam)):
+            segment = segment_view(audio, start_ms, end_ms)
             timestamp = self._ms_to_timestamp(start_ms)
             
-            detections = self._detect_song_segment(segment)
+            detections = self._detect_song_segment(segment, shazam_detections)
             
             if detections:
                 for detection in detections:
@@ -373,6 +522,22 @@ class MusicAnalyzer:
         return results
 
 
+def _reference_signature(filepath):
+    # Worker process job: load a reference song and take the signature of its
+    # middle 30 seconds
+    audio = open_audio(filepath)
+    mid_point = len(audio) // 2
+    segment = audio[mid_point-15000:mid_point+15000]
+    return MusicAnalyzer(cache_path=None)._extract_signature(segment)
+
+
+@lru_cache(maxsize=4)
+def get_analyzer(reference_folder=None):
+    # One MusicAnalyzer per reference folder and process, so repeated runs over
+    # the same folder build its reference signatures only once
+    return MusicAnalyzer(reference_folder=reference_folder)
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Music Analysis Tool")
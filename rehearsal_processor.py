@@ -1,51 +1,57 @@
 #!/usr/bin/env python3
 import os
+import csv
 import argparse
 import logging
-import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
 from pathlib import Path
-from pydub import AudioSegment, silence
-from musicAnalyzer import MusicAnalyzer
-from utils import recommend_silence_threshold, convert_to_pcm
+from musicAnalyzer import get_analyzer
+from utils import recommend_silence_threshold, detect_nonsilent_np, find_audio_files, open_audio, segment_view, detect_nonsilent_ffmpeg, positive_int
 
 class RehearsalProcessor:
-    def __init__(self, songs_folder="./songs", min_silence_len=2000, auto_threshold=True):
+    def __init__(self, songs_folder="./songs", min_silence_len=2000, auto_threshold=True, seek_step=1, pcm_cache=False, silence_backend="python"):
         self.songs_folder = songs_folder
         self.min_silence_len = min_silence_len
+        self.seek_step = seek_step
+        self.pcm_cache = pcm_cache
+        self.silence_backend = silence_backend
         self.auto_threshold = auto_threshold
-        self.analyzer = MusicAnalyzer(reference_folder=songs_folder)
+        self.analyzer = get_analyzer(songs_folder)
         
     def find_audio_files(self, folder_path):
         """Find all audio files in folder"""
-        audio_extensions = ['*.wav', '*.mp3', '*.flac', '*.m4a']
-        audio_files = []
-        
-        for ext in audio_extensions:
-            audio_files.extend(glob.glob(os.path.join(folder_path, ext)))
-            audio_files.extend(glob.glob(os.path.join(folder_path, ext.upper())))
-            
-        return sorted(audio_files)
+        return find_audio_files(folder_path)
     
     def detect_song_segments(self, audio_file):
         """Detect song segments using silence detection"""
         logging.info(f"Processing: {os.path.basename(audio_file)}")
         
-        # Convert to WAV if needed
-        if not audio_file.lower().endswith('.wav'):
-            audio_file = convert_to_pcm(audio_file)
-            
-        audio = AudioSegment.from_wav(audio_file)
+        # PCM WAVs are memory-mapped, so segments are paged in as they are
+        # sliced. With pcm_cache other formats are decoded once into a cached
+        # WAV and mapped the same way
+        audio = open_audio(audio_file, self.pcm_cache)
         
         # Auto-detect silence threshold
         silence_thresh = recommend_silence_threshold(audio)
         logging.info(f"Using silence threshold: {silence_thresh} dBFS")
         
-        # Detect segments between silences
-        segments = silence.detect_nonsilent(
-            audio, 
-            min_silence_len=self.min_silence_len,
-            silence_thresh=silence_thresh
-        )
+        # Detect segments between silences; the ffmpeg backend scans the file
+        # in C, and only the segments kept below are sliced from the decode
+        if self.silence_backend == "ffmpeg":
+            segments = detect_nonsilent_ffmpeg(
+                audio_file, len(audio),
+                min_silence_len=self.min_silence_len,
+                silence_thresh=silence_thresh
+            )
+        else:
+            segments = detect_nonsilent_np(
+                audio, 
+                min_silence_len=self.min_silence_len,
+                silence_thresh=silence_thresh,
+                seek_step=self.seek_step
+            )
         
         logging.info(f"Found {len(segments)} song segments")
         return segments, audio
@@ -55,14 +61,15 @@ class RehearsalProcessor:
         results = []
         
         for i, (start_ms, end_ms) in enumerate(segments):
-            segment = audio[start_ms:end_ms]
             duration_s = (end_ms - start_ms) / 1000
             
             # Skip very short segments
             if duration_s < 30:
                 continue
                 
-            timestamp = f"{start_ms//60000:02d}:{(start_ms//1000)%60:02d}"
+            segment = segment_view(audio, start_ms, end_ms)
+            duration_int = (end_ms - start_ms) // 1000
+            timestamp = self.analyzer._ms_to_timestamp(start_ms)
             
             logging.info(f"Analyzing segment {i+1}: {timestamp} ({duration_s:.1f}s)")
             
@@ -75,7 +82,7 @@ class RehearsalProcessor:
                         'file': os.path.basename(output_file),
                         'segment': i + 1,
                         'start_time': timestamp,
-                        'duration_s': int(duration_s),
+                        'duration_s': duration_int,
                         'song': detection['title'],
                         'artist': detection['artist'],
                         'confidence': detection['confidence'],
@@ -86,7 +93,7 @@ class RehearsalProcessor:
                     'file': os.path.basename(output_file),
                     'segment': i + 1,
                     'start_time': timestamp,
-                    'duration_s': int(duration_s),
+                    'duration_s': duration_int,
                     'song': 'undetected',
                     'artist': '',
                     'confidence': 0.0,
@@ -95,6 +102,18 @@ class RehearsalProcessor:
                 
         return results
     
+    def process_file(self, audio_file):
+        """Detect and analyze the song segments of one file"""
+        try:
+            segments, audio = self.detect_song_segments(audio_file)
+            
+            if segments:
+                return self.analyze_segments(audio, segments, audio_file)
+                
+        except Exception as e:
+            logging.error(f"Failed to process {audio_file}: {e}")
+        return []
+    
     def process_folder(self, folder_path, output_dir="./output"):
         """Process all audio files in folder"""
         audio_files = self.find_audio_files(folder_path)
@@ -106,30 +125,68 @@ class RehearsalProcessor:
         logging.info(f"Found {len(audio_files)} audio files")
         
         os.makedirs(output_dir, exist_ok=True)
-        all_results = []
+        output_path = os.path.join(output_dir, "rehearsal_analysis.csv")
         
-        for audio_file in audio_files:
-            try:
-                segments, audio = self.detect_song_segments(audio_file)
-                
-                if segments:
-                    results = self.analyze_segments(audio, segments, audio_file)
-                    all_results.extend(results)
-                    
-            except Exception as e:
-                logging.error(f"Failed to process {audio_file}: {e}")
-                continue
+        # Rows are written (and flushed) as each file finishes, so results are
+        # never all held in memory and a crash keeps the files done so far.
+        # The CSV is only created once there is a row to write.
+        f = writer = None
+        total = detected = 0
+        try:
+            for results in self._analyze_files(audio_files):
+                if not results:
+                    continue
+                if writer is None:
+                    f = open(output_path, 'w', newline='', encoding='utf-8')
+                    fieldnames = list(results[0])
+                    row = itemgetter(*fieldnames)
+                    writer = csv.writer(f)
+                    writer.writerow(fieldnames)
+                writer.writerows(map(row, results))
+                f.flush()
+                total += len(results)
+                detected += sum(1 for r in results if r['song'] != 'undetected')
+        finally:
+            if f is not None:
+                f.close()
         
-        # Save combined results
-        if all_results:
-            output_path = os.path.join(output_dir, "rehearsal_analysis.csv")
-            self.analyzer.save_results_csv(all_results, output_path)
-            
-            detected = sum(1 for r in all_results if r['song'] != 'undetected')
-            logging.info(f"Analysis complete: {detected}/{len(all_results)} segments detected")
+        if total:
+            logging.info(f"Results saved to: {output_path}")
+            logging.info(f"Analysis complete: {detected}/{total} segments detected")
             print(f"\nResults saved to: {output_path}")
         else:
             logging.warning("No segments detected in any files")
+    
+    def _analyze_files(self, audio_files):
+        """Yield the results of each file as it finishes"""
+        # Files are independent and decoding, silence detection and librosa
+        # analysis are CPU-bound, so files are spread over worker processes.
+        # Each worker holds a whole decoded recording in memory, hence the cap.
+        workers = min(4, len(audio_files), os.cpu_count() or 1)
+        if workers > 1:
+            initargs = (self, multiprocessing.Lock(), logging.getLogger().level)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+                yield from pool.map(_process_file, audio_files)
+        else:
+            for audio_file in audio_files:
+                yield self.process_file(audio_file)
+
+
+_worker_processor = None
+
+
+def _init_worker(processor, cache_lock, log_level):
+    # Runs once per worker process: keeps its copy of the processor (reference
+    # signatures included) for every file, and shares the song cache safely
+    global _worker_processor
+    logging.basicConfig(level=log_level, format='[%(levelname)s] %(message)s')
+    processor.analyzer.cache_lock = cache_lock
+    _worker_processor = processor
+
+
+def _process_file(audio_file):
+    return _worker_processor.process_file(audio_file)
+
 
 def main():
     parser = argparse.ArgumentParser(description="Rehearsal Audio Processor - Batch process folder of rehearsal recordings")
@@ -137,13 +194,19 @@ def main():
     parser.add_argument("--output", default="./output", help="Output directory for results")
     parser.add_argument("--songs", default="./songs", help="Reference songs folder")
     parser.add_argument("--min_silence", type=int, default=2000, help="Minimum silence length (ms)")
+    parser.add_argument("--seek_step", type=positive_int, default=1, help="Silence scan step (ms); larger is coarser")
+    parser.add_argument("--pcm_cache", action="store_true", help="Decode non-WAV files to memory-mapped PCM in ~/.cache/rehearsal_processor")
+    parser.add_argument("--silence_backend", choices=["python", "ffmpeg"], default="python", help="Silence detection: windowed RMS like pydub (python) or ffmpeg's silencedetect filter")
     args = parser.parse_args()
     
     logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
     
     processor = RehearsalProcessor(
         songs_folder=args.songs,
-        min_silence_len=args.min_silence
+        min_silence_len=args.min_silence,
+        seek_step=args.seek_step,
+        pcm_cache=args.pcm_cache,
+        silence_backend=args.silence_backend
     )
     
     processor.process_folder(args.folder, args.output)
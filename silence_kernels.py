@@ -0,0 +1,226 @@
+import hashlib
+import inspect
+import numpy as np
+
+try:
+    # Ahead-of-time build of the loop kernels below (python build_kernels.py);
+    # with it, numba is neither imported nor compiling anything at startup
+    import _silence_aot
+except ImportError:
+    _silence_aot = None
+
+
+def _window_mean_square_np(frames, win, block_frames=1 << 22):
+    # NumPy fallback: squares are summed in blocks so temporaries stay bounded
+    n_frames, channels = frames.shape
+    n_win = -(-n_frames // win)
+    out = np.empty(n_win)
+    block = max(1, block_frames // win)
+    for w0 in range(0, n_win, block):
+        w1 = min(w0 + block, n_win)
+        chunk = frames[w0 * win:w1 * win].astype(np.float64)
+        energy = np.square(chunk).sum(axis=1)
+        sums = np.add.reduceat(energy, np.arange(0, len(energy), win))
+        counts = np.diff(np.minimum(np.arange(w0, w1 + 1) * win, n_frames)) * channels
+        out[w0:w1] = sums / counts
+    return out
+
+
+# The *_loop kernels are written for numba: JIT-compiled at the bottom of this
+# module, or ahead of time into _silence_aot by build_kernels.py
+def _window_mean_square_loop(frames, win):
+    n_frames, channels = frames.shape
+    n_win = (n_frames + win - 1) // win
+    out = np.empty(n_win)
+    for w in range(n_win):
+        start = w * win
+        end = min(start + win, n_frames)
+        total = 0.0
+        for i in range(start, end):
+            for c in range(channels):
+                v = float(frames[i, c])
+                total += v * v
+        out[w] = total / ((end - start) * channels)
+    return out
+
+
+def _ms_energy_np(frames, frame_bounds, block_ms=60000):
+    # NumPy fallback: sum of squared samples per millisecond, in blocks so the
+    # float64 temporaries stay bounded
+    n_ms = len(frame_bounds) - 1
+    energy = np.zeros(n_ms)
+    for ms0 in range(0, n_ms, block_ms):
+        ms1 = min(ms0 + block_ms, n_ms)
+        f0 = frame_bounds[ms0]
+        chunk = frames[f0:frame_bounds[ms1]].astype(np.float64)
+        cumulative = np.concatenate(([0.0], np.cumsum(np.square(chunk).sum(axis=1))))
+        energy[ms0:ms1] = np.diff(cumulative[frame_bounds[ms0:ms1 + 1] - f0])
+    return energy
+
+
+def _silent_runs_np(energy_cs, ms_bounds, channels, min_silence_len, limit):
+    # seek_step == 1: window starts are contiguous, so window energies are plain
+    # slice differences and silent runs come from the edges of the boolean mask
+    ends = slice(min_silence_len, None)
+    starts = slice(None, len(ms_bounds) - min_silence_len)
+    n_samples = np.maximum(ms_bounds[ends] - ms_bounds[starts], 1) * channels
+    silent = energy_cs[ends] - energy_cs[starts] < limit * n_samples
+    edges = np.flatnonzero(np.diff(silent, prepend=False, append=False))
+    if len(edges) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    run_starts, run_lasts = edges[::2], edges[1::2] - 1
+    # pydub keeps merging across gaps no longer than min_silence_len
+    breaks = np.flatnonzero(run_starts[1:] - run_lasts[:-1] > min_silence_len)
+    range_starts = run_starts[np.concatenate(([0], breaks + 1))]
+    range_ends = run_lasts[np.concatenate((breaks, [len(run_lasts) - 1]))] + min_silence_len
+    return np.column_stack((range_starts, range_ends)).astype(np.int64)
+
+
+def _silent_ranges_np(energy, ms_bounds, channels, min_silence_len, seek_step, limit):
+    energy_cs = np.concatenate(([0.0], np.cumsum(energy)))
+    if seek_step == 1:
+        return _silent_runs_np(energy_cs, ms_bounds, channels, min_silence_len, limit)
+    seg_len = len(ms_bounds) - 1
+    last_slice_start = seg_len - min_silence_len
+    starts = np.arange(0, last_slice_start + 1, seek_step)
+    if last_slice_start % seek_step:
+        starts = np.append(starts, last_slice_start)
+    ends = starts + min_silence_len
+    n_samples = np.maximum(ms_bounds[ends] - ms_bounds[starts], 1) * channels
+    silence_starts = starts[energy_cs[ends] - energy_cs[starts] < limit * n_samples]
+    if len(silence_starts) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    step = np.diff(silence_starts)
+    breaks = np.flatnonzero((step != seek_step) & (step > min_silence_len))
+    range_starts = silence_starts[np.concatenate(([0], breaks + 1))]
+    range_ends = silence_starts[np.concatenate((breaks, [len(silence_starts) - 1]))] + min_silence_len
+    return np.column_stack((range_starts, range_ends))
+
+
+def _ms_energy_loop(frames, frame_bounds):
+    n_ms = len(frame_bounds) - 1
+    channels = frames.shape[1]
+    out = np.empty(n_ms)
+    for m in range(n_ms):
+        total = 0.0
+        for i in range(frame_bounds[m], frame_bounds[m + 1]):
+            for c in range(channels):
+                v = float(frames[i, c])
+                total += v * v
+        out[m] = total
+    return out
+
+
+def _silent_ranges_loop(energy, ms_bounds, channels, min_silence_len, seek_step, limit):
+    # One pass over the window starts: a rolling sum over the per-ms energies
+    # (no cumulative-sum array) gives each window's energy, which is compared
+    # with the threshold, and silent windows are merged into ranges as they
+    # are found. The energies are whole numbers, so for 8/16-bit audio the
+    # rolling sum stays exact for any window shorter than about a minute.
+    seg_len = len(ms_bounds) - 1
+    last_slice_start = seg_len - min_silence_len
+    n_starts = last_slice_start // seek_step + 1
+    if last_slice_start % seek_step:
+        n_starts += 1
+    out = np.empty((n_starts, 2), dtype=np.int64)
+    n = 0
+    prev = 0
+    window = 0.0
+    lo = 0
+    hi = 0
+    for k in range(n_starts):
+        i = min(k * seek_step, last_slice_start)
+        end = i + min_silence_len
+        while hi < end:
+            window += energy[hi]
+            hi += 1
+        while lo < i:
+            window -= energy[lo]
+            lo += 1
+        n_samples = max(ms_bounds[end] - ms_bounds[i], 1) * channels
+        if window >= limit * n_samples:
+            continue
+        if n == 0:
+            out[0, 0] = i
+            n = 1
+        elif i != prev + seek_step and i > prev + min_silence_len:
+            out[n - 1, 1] = prev + min_silence_len
+            out[n, 0] = i
+            n += 1
+        prev = i
+    if n:
+        out[n - 1, 1] = prev + min_silence_len
+    return out[:n]
+
+
+def kernels_version():
+    # Hash of the *_loop kernels' source, built into _silence_aot so a module
+    # compiled from older kernels is detected and ignored
+    digest = hashlib.blake2b(digest_size=7)
+    for kernel in (_window_mean_square_loop, _ms_energy_loop, _silent_ranges_loop):
+        digest.update(inspect.getsource(kernel).encode())
+    return int.from_bytes(digest.digest(), 'little')
+
+
+AOT_AVAILABLE = (
+    _silence_aot is not None
+    and getattr(_silence_aot, 'kernels_version', lambda: None)() == kernels_version()
+)
+
+NUMBA_AVAILABLE = False
+if not AOT_AVAILABLE:
+    try:
+        from numba import njit
+        NUMBA_AVAILABLE = True
+    except ImportError:
+        pass
+
+
+# numpy dtype of the frames -> suffix of the AOT kernels built for it
+AOT_SAMPLE_TYPES = {np.dtype(np.int8): "i1", np.dtype(np.int16): "i2", np.dtype(np.int32): "i4"}
+
+
+def _aot_kernel(name):
+    # The AOT module has one export per sample dtype rather than a dispatcher
+    exports = {dtype: getattr(_silence_aot, f"{name}_{suffix}") for dtype, suffix in AOT_SAMPLE_TYPES.items()}
+
+    def kernel(frames, *args):
+        return exports[frames.dtype](frames, *args)
+    return kernel
+
+
+if AOT_AVAILABLE:
+    _window_mean_square = _aot_kernel("window_mean_square")
+    _ms_energy = _aot_kernel("ms_energy")
+    _silent_ranges = _silence_aot.silent_ranges
+elif NUMBA_AVAILABLE:
+    _window_mean_square = njit(nogil=True, cache=True)(_window_mean_square_loop)
+    _ms_energy = njit(nogil=True, cache=True)(_ms_energy_loop)
+    _silent_ranges = njit(nogil=True, cache=True)(_silent_ranges_loop)
+else:
+    _window_mean_square = _window_mean_square_np
+    _ms_energy = _ms_energy_np
+    _silent_ranges = _silent_ranges_np
+
+
+def silent_ranges(frames, frame_rate, seg_len, min_silence_len, seek_step, thresh):
+    # Silent [start_ms, end_ms] ranges with pydub.silence.detect_silence semantics.
+    # Windows are compared in the linear domain: audioop's integer RMS satisfies
+    # floor(rms) <= thresh exactly when mean square < (floor(thresh) + 1) ** 2.
+    ms_bounds = np.arange(seg_len + 1, dtype=np.int64) * frame_rate // 1000
+    energy = _ms_energy(frames, np.minimum(ms_bounds, len(frames)))
+    limit = float((np.floor(thresh) + 1) ** 2)
+    return _silent_ranges(energy, ms_bounds, frames.shape[1], min_silence_len, seek_step, limit)
+
+
+def frame_dbfs(frames, win, max_amplitude):
+    # dBFS of consecutive `win`-frame windows of a (frames, channels) PCM array.
+    # RMS is truncated to an integer like audioop, so values match AudioSegment.dBFS
+    # and fully silent windows come out as -inf.
+    if len(frames) == 0:
+        return np.empty(0)
+    rms = np.floor(np.sqrt(_window_mean_square(frames, win)))
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(rms / max_amplitude)
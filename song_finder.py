@@ -1,40 +1,33 @@
 #!/usr/bin/env python3
 import os
 import csv
-import glob
 import argparse
-from pydub import AudioSegment, silence
-from musicAnalyzer import MusicAnalyzer
-from utils import recommend_silence_threshold, convert_to_pcm
+from musicAnalyzer import get_analyzer
+from utils import recommend_silence_threshold, detect_nonsilent_np, open_audio, find_audio_files, segment_view, positive_int
 
-def find_song_in_folder(folder_path, song_name, songs_folder="./songs"):
+def find_song_in_folder(folder_path, song_name, songs_folder="./songs", seek_step=1):
     """Find specific song in all audio files in folder"""
     # Find audio files
-    audio_files = []
-    for ext in ['*.wav', '*.mp3']:
-        audio_files.extend(glob.glob(os.path.join(folder_path, ext)))
+    audio_files = find_audio_files(folder_path, extensions=('.wav', '.mp3'))
     
     if not audio_files:
         print(f"No audio files found in {folder_path}")
         return
     
     # Setup analyzer with reference songs
-    analyzer = MusicAnalyzer(reference_folder=songs_folder)
+    analyzer = get_analyzer(songs_folder)
     results = []
+    target = song_name.lower()
     
     for audio_file in audio_files:
         print(f"Processing: {os.path.basename(audio_file)}")
         print(f"Looking for: '{song_name}'")
         
-        # Convert if needed
-        if not audio_file.lower().endswith('.wav'):
-            audio_file = convert_to_pcm(audio_file)
-        
-        audio = AudioSegment.from_wav(audio_file)
+        audio = open_audio(audio_file)
         silence_thresh = recommend_silence_threshold(audio)
         
         # Detect segments
-        segments = silence.detect_nonsilent(audio, min_silence_len=2000, silence_thresh=silence_thresh)
+        segments = detect_nonsilent_np(audio, min_silence_len=2000, silence_thresh=silence_thresh, seek_step=seek_step)
         print(f"Found {len(segments)} segments:")
         
         # Check each segment for the target song
@@ -42,11 +35,11 @@ def find_song_in_folder(folder_path, song_name, songs_folder="./songs"):
             if (end_ms - start_ms) < 30000:  # Skip short segments
                 continue
                 
-            segment = audio[start_ms:end_ms]
+            segment = segment_view(audio, start_ms, end_ms)
             detections = analyzer._detect_song_segment(segment)
             
             # Debug: show what was detected
-            timestamp = f"{start_ms//60000:02d}:{(start_ms//1000)%60:02d}"
+            timestamp = analyzer._ms_to_timestamp(start_ms)
             if detections:
                 for detection in detections:
                     print(f"  {timestamp}: {detection['title']} - {detection['artist']} ({detection['confidence']:.2f})")
@@ -55,9 +48,9 @@ def find_song_in_folder(folder_path, song_name, songs_folder="./songs"):
             
             # Check if any detection matches our target song
             for detection in detections:
-                title_match = song_name.lower() in detection['title'].lower() or detection['title'].lower() in song_name.lower()
-                artist_match = song_name.lower() in detection['artist'].lower() or detection['artist'].lower() in song_name.lower()
-                if title_match or artist_match:
+                title = detection['title'].lower()
+                artist = detection['artist'].lower()
+                if target in title or title in target or target in artist or artist in target:
                     results.append({
                         'file': os.path.basename(audio_file),
                         'time_code': timestamp,
@@ -82,9 +75,10 @@ def main():
     parser.add_argument("folder", help="Folder containing audio files")
     parser.add_argument("song", help="Song name to search for")
     parser.add_argument("--songs", default="./songs", help="Reference songs folder")
+    parser.add_argument("--seek_step", type=positive_int, default=1, help="Silence scan step (ms); larger is coarser")
     args = parser.parse_args()
     
-    find_song_in_folder(args.folder, args.song, args.songs)
+    find_song_in_folder(args.folder, args.song, args.songs, seek_step=args.seek_step)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 import os
 import logging
+import numpy as np
+import soundfile as sf
+import pytest
+from pydub import AudioSegment
+from pydub.silence import detect_nonsilent
+import silence_kernels
 from rehearsal_processor import RehearsalProcessor
+from utils import detect_nonsilent_np, read_soundfile, recommend_silence_threshold
 
 def test_processor():
     """Test the rehearsal processor with existing songs folder"""
@@ -20,5 +27,74 @@ def test_processor():
     
     print("\nTest complete! Check ./output/test/rehearsal_analysis.csv")
 
+
+def _silence_backends():
+    """(energy kernel, range kernel) params for every silence backend available here"""
+    backends = [pytest.param(silence_kernels._ms_energy_np, silence_kernels._silent_ranges_np, id="numpy")]
+    try:
+        from numba import njit
+        backends.append(pytest.param(
+            njit(nogil=True, cache=True)(silence_kernels._ms_energy_loop),
+            njit(nogil=True, cache=True)(silence_kernels._silent_ranges_loop),
+            id="numba"))
+    except ImportError:
+        pass
+    if silence_kernels.AOT_AVAILABLE:
+        backends.append(pytest.param(
+            silence_kernels._aot_kernel("ms_energy"), silence_kernels._silence_aot.silent_ranges, id="aot"))
+    return backends
+
+
+def _rehearsal_like(sample_width, channels, seed, frame_rate=8000):
+    """A few seconds of noise bursts and near-silent gaps at random levels"""
+    rng = np.random.default_rng(seed)
+    parts = [
+        rng.normal(0, rng.choice([0.001, 0.01, 0.05, 0.3, 0.6]), size=(frame_rate * int(rng.integers(30, 500)) // 1000, channels))
+        for _ in range(12)
+    ]
+    dtype = {1: np.int8, 2: np.int16, 4: np.int32}[sample_width]
+    pcm = (np.clip(np.concatenate(parts), -1, 1) * np.iinfo(dtype).max).astype(dtype)
+    return AudioSegment(data=pcm.tobytes(), sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+
+
+@pytest.mark.parametrize("ms_energy, silent_ranges", _silence_backends())
+@pytest.mark.parametrize("sample_width", [1, 2, 4])
+@pytest.mark.parametrize("channels", [1, 2])
+@pytest.mark.parametrize("seek_step", [1, 7, 50])
+def test_detect_nonsilent_matches_pydub(monkeypatch, ms_energy, silent_ranges, sample_width, channels, seek_step):
+    """detect_nonsilent_np gives pydub's ranges exactly, whichever kernels run it"""
+    monkeypatch.setattr(silence_kernels, "_ms_energy", ms_energy)
+    monkeypatch.setattr(silence_kernels, "_silent_ranges", silent_ranges)
+    for seed in range(3):
+        audio = _rehearsal_like(sample_width, channels, seed)
+        for min_silence_len, silence_thresh in [(100, -30), (250, -20), (10000, -30)]:
+            expected = detect_nonsilent(audio, min_silence_len, silence_thresh, seek_step)
+            assert detect_nonsilent_np(audio, min_silence_len, silence_thresh, seek_step) == expected
+
+@pytest.mark.parametrize("subtype, channels", [("PCM_16", 2), ("PCM_16", 1), ("PCM_32", 2)])
+def test_mapped_samples_match_pydub(tmp_path, subtype, channels):
+    """A memory-mapped WAV gives pydub's samples, including the sub-millisecond tail"""
+    path = str(tmp_path / "odd_length.wav")
+    rng = np.random.default_rng(0)
+    sf.write(path, rng.uniform(-0.5, 0.5, size=(44107, channels)), 44100, subtype=subtype)
+    mapped = read_soundfile(path)
+    expected = AudioSegment.from_wav(path)
+    assert type(mapped).__name__ == "MappedAudioSegment"
+    assert mapped.get_array_of_samples() == expected.get_array_of_samples()
+    assert [bytes(m.raw_data) for m in mapped.split_to_mono()] == [m.raw_data for m in expected.split_to_mono()]
+
+@pytest.mark.parametrize("seed", range(4))
+def test_recommended_threshold_matches_pydub_loop(seed):
+    """The vectorized recommendation equals the per-100ms pydub dBFS loop, long recordings included"""
+    rng = np.random.default_rng(seed)
+    frame_rate = 8000
+    # Over 2M frames of near-bimodal levels: quiet room tone and loud takes
+    levels = rng.choice([0.002, 0.3], size=2700, p=[0.55, 0.45]) * rng.uniform(0.8, 1.2, size=2700)
+    samples = rng.normal(0, 1, size=(2700, frame_rate // 10)) * levels[:, None]
+    pcm = (np.clip(samples.ravel(), -1, 1) * 32767).astype(np.int16)
+    audio = AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=frame_rate, channels=1)
+    dbfs = np.array([audio[i:i + 100].dBFS for i in range(0, len(audio), 100)])
+    assert recommend_silence_threshold(audio) == recommend_silence_threshold(dbfs)
+
 if __name__ == "__main__":
     test_processor()
\ No newline at end of file